@@ -1,8 +1,26 @@
+import csv
+import io
 import os
+import re
 import pandas as pd
-from scipy.spatial.distance import euclidean
 import numpy as np
 
+# matches a "SAMPLE IA-XX" section header (group 1) or a group section header (group 2)
+_HEADER_PATTERN = re.compile(
+    r"SAMPLE IA-(\d{2})|(Peer Group|Instrument Groups|Method Groups|Reagent Groups)"
+)
+
+# {group section header: group name stored in the reference table}
+_GROUP_HEADERS = {
+    "Peer Group": "Peer Group",
+    "Instrument Groups": "Instrument Group",
+    "Method Groups": "Method Group",
+    "Reagent Groups": "Reagent Group",
+}
+
+# hyphen between the low and high numbers of a "low-high" range
+_RANGE_HYPHEN = re.compile(r"(?<=\d)-(?=\d)")
+
 class DataComparison:
     """
     Compares experimental sample data with reference dataset of instrument measurements.
@@ -23,6 +41,46 @@ class DataComparison:
         self.reference_df = reference_df
         self.sample_values_dict = sample_values_dict
 
+        # column arrays shared by the find_* reductions so each one is a
+        # single scan over contiguous float64 data instead of a DataFrame pass;
+        # a missing instrument name gets its own code rather than the -1 sentinel,
+        # which would index (and be counted under) the last instrument
+        self._inst_codes, self._inst_names = pd.factorize(
+            reference_df["Instrument"], use_na_sentinel=False
+        )
+        self._mean = reference_df["Mean"].to_numpy(dtype=np.float64)
+        self._low = reference_df["Low Range"].to_numpy(dtype=np.float64)
+        self._high = reference_df["High Range"].to_numpy(dtype=np.float64)
+        sample_numbers = reference_df["Sample Number"].to_numpy(dtype=np.int64)
+        self._sample_codes = sample_numbers - 1
+
+        # {sample number: value} as an array indexed by sample number,
+        # NaN where we have no such sample
+        n_slots = max(max(sample_values_dict, default=0), int(sample_numbers.max(initial=0))) + 1
+        sample_lookup = np.full(n_slots, np.nan)
+        for sample_num, value in sample_values_dict.items():
+            sample_lookup[sample_num] = value
+
+        # sample value matching each reference row (NaN if we have no such sample)
+        self._sval = sample_lookup[sample_numbers]
+
+        # sample values ordered by sample number
+        self._sample_vector = np.array(
+            [sample_values_dict[i] for i in sorted(sample_values_dict)], dtype=np.float64
+        )
+
+    def _best_instrument(self, mask):
+
+        """
+        Count the rows of each instrument where mask is True and return
+        (instrument, count) for the highest count. Ties resolve to the
+        instrument that appears first in the reference data.
+        """
+
+        counts = np.bincount(self._inst_codes, weights=mask, minlength=len(self._inst_names))
+        best_index = int(counts.argmax())
+        return self._inst_names[best_index], int(counts[best_index])
+
     def find_closest_euclidean_distance(self):
 
         """
@@ -35,28 +93,47 @@ class DataComparison:
                 - best_distance (float): Minimum Euclidean distance.
         """
 
-        sample_vector = np.array([self.sample_values_dict[i] for i in sorted(self.sample_values_dict)])
-
         # create a table with each row as an instrument,
         # each col as a sample number,
         # and each value as the mean for that instrument and sample
-        pivot = self.reference_df.pivot_table(
-            index="Instrument", 
-            columns="Sample Number", 
-            values="Mean"
-        )
+        # (averaged if an instrument has more than one row for a sample)
+        n_samples = int(self._sample_codes.max()) + 1
+        shape = (len(self._inst_names), n_samples)
+        has_mean = ~np.isnan(self._mean)
+        cells = (self._inst_codes[has_mean], self._sample_codes[has_mean])
 
-        # drop rows that don't have all samples from consideration
-        pivot = pivot.dropna()
+        mean_sums = np.zeros(shape)
+        mean_counts = np.zeros(shape)
+        np.add.at(mean_sums, cells, self._mean[has_mean])
+        np.add.at(mean_counts, cells, 1)
 
-        # dict of {instrument: distance from sample vector}
-        distances = {
-            instrument: euclidean(pivot.loc[instrument].values, sample_vector)
-            for instrument in pivot.index
-        }
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = mean_sums/mean_counts
 
-        best_match = min(distances, key=distances.get)
-        return (best_match, distances[best_match])
+        # skip sample numbers no instrument reported, then
+        # drop rows that don't have all samples from consideration
+        means = means[:, ~np.isnan(means).all(axis=0)]
+        complete = ~np.isnan(means).any(axis=1) & self._inst_names.notna()
+        pivot_values = means[complete]
+        instruments = self._inst_names[complete]
+
+        # distance of every instrument row from the sample vector, using
+        # ||a - b||^2 = ||a||^2 - 2 a.b + ||b||^2 so the cross term is a single
+        # matrix-vector product; clip tiny negative round-off before the sqrt
+        squared_norms = np.einsum("ij,ij->i", pivot_values, pivot_values)
+        sample_norm = self._sample_vector @ self._sample_vector
+        squared_distances = squared_norms - 2*(pivot_values @ self._sample_vector) + sample_norm
+        distances = np.sqrt(np.maximum(squared_distances, 0.0))
+
+        # rank instruments by name as pivot_table did, so ties
+        # resolve to the alphabetically first instrument
+        order = instruments.argsort()
+        best_index = int(order[distances[order].argmin()])
+
+        # the expansion loses precision to cancellation when a row is very close
+        # to the sample, so report the exact distance of the winning row
+        best_distance = np.linalg.norm(pivot_values[best_index] - self._sample_vector)
+        return (instruments[best_index], float(best_distance))
     
     def count_within_bounds(sample_values, low_bounds, high_bounds):
 
@@ -76,28 +153,10 @@ class DataComparison:
                     - max_within_bounds (int): Highest number of within range samples.
         """
 
-        instruments = self.reference_df["Instrument"].unique()
-        best_match = None
-        max_within_bounds = -1
+        # missing samples are NaN and compare False, so they are never counted
+        within_bounds = (self._sval >= self._low) & (self._sval <= self._high)
 
-        for instrument in instruments:
-            # filter rows for this instrument
-            df_instrument = self.reference_df[self.reference_df["Instrument"] == instrument]
-
-            count = 0
-            for _, row in df_instrument.iterrows():
-                sample_num = row["Sample Number"]
-                value = self.sample_values_dict.get(sample_num, None)
-
-                if value is not None:
-                    if row["Low Range"] <= value <= row["High Range"]:
-                        count += 1
-
-            if count > max_within_bounds:
-                max_within_bounds = count
-                best_match = instrument
-        
-        return best_match, max_within_bounds
+        return self._best_instrument(within_bounds)
     
     def find_most_within_percent(self, percent):
 
@@ -115,29 +174,11 @@ class DataComparison:
                     - max_within_percent (int): Highest number of samples within a percent of the mean.
         """
 
-        instruments = self.reference_df["Instrument"].unique()
-        best_match = None
-        max_within_percent = -1
-
-        for instrument in instruments:
-            # filter rows for this instrument
-            df_instrument = self.reference_df[self.reference_df["Instrument"] == instrument]
-
-            count = 0
-            for _, row in df_instrument.iterrows():
-                sample_num = row["Sample Number"]
-                value = self.sample_values_dict.get(sample_num, None)
-
-                if value is not None:
-                    percent_diff = (value - row["Mean"])/row["Mean"]
-                    if abs(percent_diff) <= percent/100:
-                        count += 1
-
-            if count > max_within_percent:
-                max_within_percent = count
-                best_match = instrument
-        
-        return best_match, max_within_percent
+        # a zero mean gives inf/NaN here, which never counts as within percent
+        with np.errstate(divide="ignore", invalid="ignore"):
+            within_percent = np.abs((self._sval - self._mean)/self._mean) <= percent/100
+
+        return self._best_instrument(within_percent)
     
 class ReferenceData:
     """
@@ -148,18 +189,17 @@ class ReferenceData:
     """
 
     def __init__(self, reference_data_file_path):
-        # {Sample Name: reading that section of the data table (True/False)}
-        self.in_sample_dict = {}
-        for sample in range(1, 11):
-            self.in_sample_dict[sample] = False
+        # sample number whose section of the data table we are reading (0 if none yet)
+        self._current_sample = 0
 
-        # {Group Name: reading that section of the data table (True/False)}
-        self.in_group_dict = {}
-        for group in ["Peer Group", "Instrument Group", "Method Group",  "Reagent Group"]:
-            self.in_group_dict[group] = False
+        # group type whose section of the data table we are reading
+        self._current_group = "No Group Found"
 
         self.reference_data_file_path = reference_data_file_path
         self.reference_df = pd.DataFrame(self.load_reference_data())
+        self._instrument_groups = self.reference_df.groupby(
+            "Instrument", sort=False, observed=True
+        )
     
     def set_in_sample(self, sample):
 
@@ -168,10 +208,7 @@ class ReferenceData:
         reading in the reference table.
         """
 
-        self.in_sample_dict[sample] = True
-        for i in range(1, 11):
-            if i != sample:
-                self.in_sample_dict[i] = False
+        self._current_sample = sample
     
     def get_in_sample(self):
 
@@ -180,11 +217,7 @@ class ReferenceData:
         reading in the reference table.
         """
 
-        for sample in self.in_sample_dict.keys():
-            if self.in_sample_dict[sample] == True:
-                return sample
-
-        return 0
+        return self._current_sample
 
     def set_in_group(self, group):
 
@@ -193,10 +226,7 @@ class ReferenceData:
         reading in the reference table.
         """
 
-        self.in_group_dict[group] = True
-        for group_key in self.in_group_dict.keys():
-            if group_key != group:
-                self.in_group_dict[group_key] = False
+        self._current_group = group
 
     def get_in_group(self):
 
@@ -205,14 +235,16 @@ class ReferenceData:
         reading in the reference table.
         """
 
-        for group in self.in_group_dict.keys():
-            if self.in_group_dict[group] == True:
-                return group
-            
-        return "No Group Found"
+        return self._current_group
 
     def get_reference_df(self):
-        return self.reference_df.copy()
+
+        """
+        Return the reference dataframe without copying it.
+        Callers should treat it as read-only.
+        """
+
+        return self.reference_df
 
     def load_reference_data(self):
         """
@@ -224,7 +256,7 @@ class ReferenceData:
 
         Returns:
             reference_df (pd.DataFrame): Dataframe containing reference data with columns:
-                - "Instrument" (str) --> name of the instrument
+                - "Instrument" (category) --> name of the instrument
                 - "Sample Number" (int64) --> sample number 1-10
                 - "Group" (str) --> "Peer Group", "Instrument Group"
                             "Method Group", or "Reagent Group" (str)
@@ -239,37 +271,16 @@ class ReferenceData:
         with open(self.reference_data_file_path, "r") as f:
             all_lines = f.readlines()
 
-        reference_data_list = []
+        # data rows re-joined with tabs (instrument names contain spaces),
+        # tokenized in one go by the pandas C parser below
+        reference_data_lines = []
 
         for line in all_lines:
-            if "SAMPLE IA-01" in line:
-                self.set_in_sample(1)
-            elif "SAMPLE IA-02" in line:
-                self.set_in_sample(2)
-            elif "SAMPLE IA-03" in line:
-                self.set_in_sample(3)
-            elif "SAMPLE IA-04" in line:
-                self.set_in_sample(4)
-            elif "SAMPLE IA-05" in line:
-                self.set_in_sample(5)
-            elif "SAMPLE IA-06" in line:
-                self.set_in_sample(6)
-            elif "SAMPLE IA-07" in line:
-                self.set_in_sample(7)
-            elif "SAMPLE IA-08" in line:
-                self.set_in_sample(8)
-            elif "SAMPLE IA-09" in line:
-                self.set_in_sample(9)
-            elif "SAMPLE IA-10" in line:
-                self.set_in_sample(10)
-            elif "Peer Group" in line:
-                self.set_in_group("Peer Group")
-            elif "Instrument Groups" in line:
-                self.set_in_group("Instrument Group")
-            elif "Method Groups" in line:
-                self.set_in_group("Method Group")
-            elif "Reagent Groups" in line:
-                self.set_in_group("Method Group")
+            header = _HEADER_PATTERN.search(line)
+            if header is not None and header.group(1) is not None:
+                self.set_in_sample(int(header.group(1)))
+            elif header is not None:
+                self.set_in_group(_GROUP_HEADERS[header.group(2)])
             elif line.strip() == "" or "All Participants" in line:
                 continue
             else: # we are in a data block
@@ -277,38 +288,71 @@ class ReferenceData:
                 if sample_num == 0:
                     print("Error. Could not identify the sample block number")
                 else:
-                    # remove the hyphen indicating range
-                    line = line.replace("-", "")
                     line_data = line.split()
+
+                    # the range is written "low - high", "low- high", "low -high"
+                    # or "low-high"; turn it back into two fields without touching
+                    # hyphens in the instrument name
+                    if len(line_data) >= 7 and line_data[-3] == "-":
+                        del line_data[-3]
+                    elif len(line_data) >= 6 and line_data[-3].endswith("-"):
+                        line_data[-3] = line_data[-3][:-1]
+                    elif len(line_data) >= 6 and line_data[-2].startswith("-"):
+                        line_data[-2] = line_data[-2][1:]
+                    elif len(line_data) >= 5:
+                        range_parts = _RANGE_HYPHEN.split(line_data[-2])
+                        if len(range_parts) == 2:
+                            line_data[-2:-1] = range_parts
                     instrument_name = " ".join(line_data[:-6])
                     sample_num = self.get_in_sample()
                     group = self.get_in_group()
-                    row_data = [instrument_name, sample_num, group] + line_data[-6:]
-                    reference_data_list.append(row_data)
-
-        reference_df = pd.DataFrame(reference_data_list)
-        reference_df.columns = ["Instrument", 
-                     "Sample Number", 
-                     "Group", 
-                     "# Labs", 
-                     "Mean", 
-                     "SD", 
-                     "Low Range", 
-                     "High Range", 
-                     "Uncertainty"]
-        
-        # convert numeric columns to numeric types
-        numeric_cols = ["Sample Number", "# Labs", "Mean", "SD", "Low Range", "High Range", "Uncertainty"]
-        reference_df[numeric_cols] = reference_df[numeric_cols].apply(pd.to_numeric, errors='coerce')
+                    row_data = [instrument_name, str(sample_num), group] + line_data[-6:]
+                    reference_data_lines.append("\t".join(row_data))
+
+        reference_df = pd.read_csv(
+            io.StringIO("\n".join(reference_data_lines)),
+            sep="\t",
+            header=None,
+            quoting=csv.QUOTE_NONE,
+            names=["Instrument", 
+                   "Sample Number", 
+                   "Group", 
+                   "# Labs", 
+                   "Mean", 
+                   "SD", 
+                   "Low Range", 
+                   "High Range", 
+                   "Uncertainty"],
+            dtype={"Instrument": "category", "Sample Number": np.int64, "Group": str},
+            # keep instrument names like "NA" or "" as text; the numeric
+            # columns are coerced below, which still turns stray text into NaN
+            keep_default_na=False,
+        )
+
+        # the parser already typed the numeric columns; coerce any that held stray text
+        numeric_cols = ["# Labs", "Mean", "SD", "Low Range", "High Range", "Uncertainty"]
+        for col in numeric_cols:
+            if not pd.api.types.is_numeric_dtype(reference_df[col]):
+                reference_df[col] = pd.to_numeric(reference_df[col], errors='coerce')
 
         return reference_df
 
     def get_instrument_values(self, instrument):
-        return self.reference_df[self.reference_df["Instrument"] == instrument]
+
+        """
+        Return the reference rows for one instrument. The rows of every
+        instrument are indexed by a single groupby pass on first use,
+        so repeated lookups don't rescan the whole table.
+        """
+
+        try:
+            return self._instrument_groups.get_group(instrument)
+        except KeyError:
+            return self.reference_df.iloc[0:0]
     
 class SampleData:
     """
-    Loads sample data into a dictionary and provides methods to access sample data.
+    Loads sample data into a NumPy array and provides methods to access sample data.
     
     Args:
         sample_data_file_path (string): Path to the sample data file.
@@ -317,22 +361,24 @@ class SampleData:
     def __init__(self, sample_data_file_path):
 
         self.sample_data_file_path = sample_data_file_path
-        self.sample_values_dict = self.load_sample_data()
+        self.sample_values = self.load_sample_data()
+        self.sample_values_dict = dict(enumerate(self.sample_values.tolist(), 1))
     
     def load_sample_data(self):
 
-        """Load sample concentrations into a dictionary keyed by sample number."""
+        """
+        Load sample concentrations into a float64 array ordered by sample number.
+        Every line must hold one value, so a blank line raises ValueError
+        instead of shifting the later samples down a number.
+        """
 
-        sample_values_dict = {}
         with open(self.sample_data_file_path, "r") as f:
-            all_lines = f.readlines()
-        
-        i = 1
-        for line in all_lines:
-            sample_values_dict[i] = float(line.strip())
-            i += 1
-        
-        return sample_values_dict
+            all_lines = f.read().splitlines()
+
+        return np.array([float(line) for line in all_lines], dtype=np.float64)
+
+    def get_sample_values_array(self):
+        return self.sample_values.copy()
 
     def get_sample_values_dict(self):
         return self.sample_values_dict.copy()